@@ -1,18 +1,132 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-import json
+import orjson
+import msgspec
 import asyncio
-import random
-from datetime import datetime
-from typing import Dict
-import subprocess
+import array
+import numpy as np
+import time
+from typing import Dict, Optional, Set
+from contextlib import aclosing, asynccontextmanager
+import threading
+import logging
 import re
 import sys
 import os
 
-app = FastAPI(title="ROS Topic Viewer")
+# Per-message diagnostics; silent unless the app configures this logger
+logger = logging.getLogger("ros_stream")
+logger.addHandler(logging.NullHandler())
+
+# rclpy is only importable once a ROS2 setup has been sourced; without it
+# topics are read through the ros2 CLI instead
+try:
+    import rclpy
+    from rclpy.executors import MultiThreadedExecutor
+    from rclpy.qos import qos_profile_sensor_data
+    from rosidl_runtime_py.convert import message_to_ordereddict
+    from rosidl_runtime_py.utilities import get_message
+except ImportError:
+    rclpy = None
+
+# In-process ROS2 node, set up in lifespan() when rclpy is available
+_ros_node = None
+_ros_executor = None
+
+
+def start_ros2_node() -> None:
+    """Create the shared rclpy node and spin it on a background thread"""
+    global _ros_node, _ros_executor
+    if rclpy is None:
+        print("rclpy not available, using ros2 CLI subprocesses")
+        return
+    # The CLI path switches rolling to humble (see resolve_ros2_env); an
+    # in-process node would be stuck on whatever distro rclpy was imported from
+    if sys.platform == 'linux' and os.environ.get('ROS_DISTRO') == 'rolling':
+        print("ROS_DISTRO=rolling, using ros2 CLI subprocesses with humble")
+        return
+    try:
+        rclpy.init()
+        _ros_node = rclpy.create_node("ros_topic_viewer")
+        _ros_executor = MultiThreadedExecutor()
+        _ros_executor.add_node(_ros_node)
+        threading.Thread(target=_ros_executor.spin, daemon=True).start()
+        print("rclpy node started")
+    except Exception as e:
+        print(f"Failed to start rclpy node, using ros2 CLI subprocesses: {e}")
+        _ros_node = None
+        _ros_executor = None
+
+
+def stop_ros2_node() -> None:
+    """Shut down the shared rclpy node"""
+    global _ros_node, _ros_executor
+    if _ros_node is None:
+        return
+    _ros_executor.shutdown()
+    _ros_node.destroy_node()
+    rclpy.shutdown()
+    _ros_node = None
+    _ros_executor = None
+    print("rclpy node stopped")
+
+
+# Environment for ros2 CLI subprocesses, resolved once in lifespan()
+# (None inherits os.environ)
+_ros2_env = None
+
+
+async def resolve_ros2_env() -> Dict[str, str]:
+    """Build the ros2 CLI environment once, so no subprocess has to source setup.bash"""
+    env = os.environ.copy()
+    print(f"Original ROS_DISTRO: {env.get('ROS_DISTRO', 'Not set')}")
+    
+    # Force use of ROS2 humble if on Linux and rolling is detected
+    if sys.platform == 'linux' and env.get('ROS_DISTRO') == 'rolling':
+        print(f"Detected ROS_DISTRO=rolling, switching to humble...")
+        
+        # Clear ROS-related environment variables to avoid conflicts
+        ros_vars_to_clear = [k for k in env.keys() if k.startswith('ROS_') or k.startswith('AMENT_') or 'ros' in k.lower()]
+        for var in ros_vars_to_clear:
+            if var in ['ROSLISP_PACKAGE_DIRECTORIES', 'ROS_DISTRO', 'ROS_VERSION', 'ROS_PYTHON_VERSION']:
+                del env[var]
+        
+        # Source humble once and capture the resulting environment
+        process = await asyncio.create_subprocess_exec(
+            '/bin/bash', '-c', 'source /opt/ros/humble/setup.bash && env -0',
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=env
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            print(f"Failed to source humble: {stderr.decode().strip()}")
+            return env
+        
+        env = dict(entry.split('=', 1) for entry in stdout.decode().split('\0') if '=' in entry)
+    
+    return env
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _ros2_env
+    start_ros2_node()
+    if _ros_node is None:
+        _ros2_env = await resolve_ros2_env()
+    yield
+    await stop_topic_hubs()
+    stop_ros2_node()
+
+
+app = FastAPI(title="ROS Topic Viewer", default_response_class=ORJSONResponse, lifespan=lifespan)
+
+# orjson returns bytes, so SSE frames are built without an encode round-trip
+_DUMPS = orjson.dumps
+# Binary framing for /stream_mp clients that don't need browser-friendly SSE
+_ENC = msgspec.msgpack.Encoder()
 
 # Configure templates
 templates = Jinja2Templates(directory="templates")
@@ -25,171 +139,377 @@ TOPICS = {
     "/turtle1/pose": "turtlesim/Pose"
 }
 
+# ros2 topic echo output: "key: value" lines, messages separated by "---"
+_KV_RE = re.compile(r'^([a-zA-Z_][a-zA-Z0-9_]*)\s*:\s*(.*)$')
+_SEP = '---'
+# JSON number grammar; values matching it are copied into the output verbatim
+_NUM_RE = re.compile(r'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?')
+# ros2 topic echo stdout buffer limit, and longest line worth parsing (longer
+# ones are big array dumps, not telemetry fields)
+_STDOUT_LIMIT = 1 << 20
+_MAX_LINE = 4096
+_SEP_BYTES = _SEP.encode()
 
-def generate_random_coordinates(topic_name: str) -> Dict:
-    """Generate random coordinate values based on topic type"""
-    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
+
+def _fast_ts(ns: Optional[int] = None) -> str:
+    """Format a time.time_ns() value (default: now) as local HH:MM:SS.mmm"""
+    if ns is None:
+        ns = time.time_ns()
+    s, ns = divmod(ns, 1_000_000_000)
+    lt = time.localtime(s)
+    return f"{lt.tm_hour:02d}:{lt.tm_min:02d}:{lt.tm_sec:02d}.{ns // 1_000_000:03d}"
+
+
+# Random demo values are drawn in batches: one numpy call fills, scales and
+# rounds a whole pool of rows, and each message just takes the next row
+_RNG = np.random.default_rng()
+_POOL_SIZE = 4096
+
+
+def random_rows(low, high):
+    """Endlessly yield rows of uniform values in [low, high), rounded to 3 decimals"""
+    while True:
+        yield from np.round(_RNG.uniform(low, high, size=(_POOL_SIZE, len(low))), 3).tolist()
+
+
+_POSITION_ROWS = random_rows((-100, -100, 0), (100, 100, 50))
+_VELOCITY_ROWS = random_rows((-5, -5, -2, -1, -1, -1), (5, 5, 2, 1, 1, 1))
+_XY_ROWS = random_rows((-10, -10), (10, 10))
+
+
+# Builders are specialised per topic at import time: the topic name and the
+# row source are bound once, leaving only the values to fill in per message
+
+def _position_shape(topic_name: str):
+    next_row = _POSITION_ROWS.__next__
     
-    if "position" in topic_name or "gps" in topic_name:
-        return {
-            "topic": topic_name,
-            "timestamp": timestamp,
-            "data": {
-                "x": round(random.uniform(-100, 100), 3),
-                "y": round(random.uniform(-100, 100), 3),
-                "z": round(random.uniform(0, 50), 3)
-            }
-        }
-    elif "velocity" in topic_name:
-        return {
-            "topic": topic_name,
-            "timestamp": timestamp,
-            "data": {
-                "linear": {
-                    "x": round(random.uniform(-5, 5), 3),
-                    "y": round(random.uniform(-5, 5), 3),
-                    "z": round(random.uniform(-2, 2), 3)
-                },
-                "angular": {
-                    "x": round(random.uniform(-1, 1), 3),
-                    "y": round(random.uniform(-1, 1), 3),
-                    "z": round(random.uniform(-1, 1), 3)
-                }
-            }
-        }
-    else:
+    def build(timestamp: str) -> Dict:
+        x, y, z = next_row()
+        return {"topic": topic_name, "timestamp": timestamp, "data": {"x": x, "y": y, "z": z}}
+    return build
+
+
+def _velocity_shape(topic_name: str):
+    next_row = _VELOCITY_ROWS.__next__
+    
+    def build(timestamp: str) -> Dict:
+        lx, ly, lz, ax, ay, az = next_row()
         return {
             "topic": topic_name,
             "timestamp": timestamp,
             "data": {
-                "x": round(random.uniform(-10, 10), 3),
-                "y": round(random.uniform(-10, 10), 3)
+                "linear": {"x": lx, "y": ly, "z": lz},
+                "angular": {"x": ax, "y": ay, "z": az}
             }
         }
+    return build
+
+
+def _xy_shape(topic_name: str):
+    next_row = _XY_ROWS.__next__
+    
+    def build(timestamp: str) -> Dict:
+        x, y = next_row()
+        return {"topic": topic_name, "timestamp": timestamp, "data": {"x": x, "y": y}}
+    return build
+
 
-def parse_ros2_generic_output(output_line: str, data_buffer: Dict, parser_state: Dict) -> None:
+# Message shape per known topic; anything else gets plain x/y values
+_TOPIC_SHAPE = {
+    "/robot/position": _position_shape,
+    "/sensor/gps": _position_shape,
+    "/robot/velocity": _velocity_shape,
+    "/turtle1/pose": _xy_shape
+}
+_BUILDERS = {topic: shape(topic) for topic, shape in _TOPIC_SHAPE.items()}
+
+
+def generate_random_coordinates(topic_name: str) -> Dict:
+    """Generate random coordinate values based on topic type"""
+    build = _BUILDERS.get(topic_name)
+    if build is None:
+        build = _xy_shape(topic_name)
+    return build(_fast_ts())
+
+def parse_ros2_generic_output(output_line: str, out: bytearray, parser_state: Dict) -> None:
     """
     Generic parser for ROS2 topic echo output.
-    Parses any message format including nested structures.
+    Parses any message format including nested structures, writing the
+    message as JSON straight into `out` (no intermediate dict).
     
     Args:
         output_line: Single line from ros2 topic echo (with original indentation)
-        data_buffer: Dictionary to store parsed data
+        out: Buffer receiving the JSON object; complete it with finish_ros2_json()
         parser_state: State information for parsing (indentation tracking, etc.)
     """
+    line = output_line.strip()
+    
     # Skip lines that are just separators or empty
-    if not output_line or output_line.strip() == '---' or not output_line.strip():
+    if not line or line == _SEP:
         return
     
     # Count leading spaces for indentation level
     indent = len(output_line) - len(output_line.lstrip())
-    line = output_line.strip()
     
     # Match key:value pattern
-    match = re.match(r'^([a-zA-Z_][a-zA-Z0-9_]*)\s*:\s*(.*)$', line)
+    match = _KV_RE.match(line)
     
     if match:
         key = match.group(1)
         value = match.group(2).strip()
         
-        # Initialize indent stack if needed
+        # Still inside the children of a skipped duplicate key
+        skip_indent = parser_state.get('skip_indent')
+        if skip_indent is not None:
+            if indent > skip_indent:
+                return
+            parser_state['skip_indent'] = None
+        
+        # Open the message root on its first field
         if 'indent_stack' not in parser_state:
-            parser_state['indent_stack'] = []
+            parser_state['indent_stack'] = [-1]
+            parser_state['key_stack'] = [set()]
+            parser_state['opened'] = True
+            out += b'{'
+        indent_stack = parser_state['indent_stack']
+        key_stack = parser_state['key_stack']
         
-        # Pop stack until we find the correct parent level
-        while parser_state['indent_stack'] and parser_state['indent_stack'][-1]['indent'] >= indent:
-            parser_state['indent_stack'].pop()
+        # Close objects until we are back at the parent level (the root is never closed)
+        while indent_stack[-1] >= indent:
+            indent_stack.pop()
+            key_stack.pop()
+            out += b'}'
+            parser_state['opened'] = False
         
-        # Build the full key path
-        if parser_state['indent_stack']:
-            parent_path = parser_state['indent_stack'][-1]['path']
-            full_key = f"{parent_path}.{key}"
-        else:
-            full_key = key
+        # Keys repeat at one level for list-of-struct fields ("- x: ..." items
+        # are not parsed); keep the first so the JSON has no duplicate keys
+        if key in key_stack[-1]:
+            if not value:
+                parser_state['skip_indent'] = indent
+            return
+        key_stack[-1].add(key)
+        
+        # Separate from the previous sibling; keys are plain identifiers, no escaping needed
+        if not parser_state['opened']:
+            out += b','
+        out += b'"' + key.encode() + b'":'
         
         # If value is empty, this is a parent for nested fields
         if not value:
-            parser_state['indent_stack'].append({'indent': indent, 'path': full_key})
+            out += b'{'
+            indent_stack.append(indent)
+            key_stack.append(set())
+            parser_state['opened'] = True
         else:
-            # Try to parse value as number, otherwise keep as string
-            try:
-                # Try integer first
-                if '.' not in value and 'e' not in value.lower():
-                    parsed_value = int(value)
-                else:
-                    parsed_value = float(value)
-            except ValueError:
-                # Keep as string
-                parsed_value = value
-            
-            # Store in data buffer with full path
-            data_buffer[full_key] = parsed_value
+            # Numbers are already valid JSON; anything else (nan, true, names) is a string
+            if _NUM_RE.fullmatch(value):
+                out += value.encode()
+            else:
+                out += _DUMPS(value)
+            parser_state['opened'] = False
 
 
-def flatten_to_nested_dict(flat_dict: Dict) -> Dict:
-    """Convert flat dictionary with dot notation to nested dictionary"""
-    result = {}
+def finish_ros2_json(out: bytearray, parser_state: Dict) -> bytes:
+    """Close every object still open in `out` and return the finished JSON"""
+    out += b'}' * len(parser_state['indent_stack'])
+    return bytes(out)
+
+
+class LatestValue:
+    """
+    Single-slot buffer that only keeps the newest item.
     
-    for key, value in flat_dict.items():
-        parts = key.split('.')
-        current = result
+    set() never blocks: an unread item is replaced and counted in `skipped`.
+    After close(), get() still returns a pending item, then None.
+    """
+
+    __slots__ = ('_value', '_pending', '_closed', '_event', 'skipped')
+
+    def __init__(self):
+        self._value = None
+        self._pending = False
+        self._closed = False
+        self._event = asyncio.Event()
+        self.skipped = 0
+
+    def set(self, value) -> None:
+        if self._pending:
+            self.skipped += 1
+        self._value = value
+        self._pending = True
+        self._event.set()
+
+    def close(self) -> None:
+        self._closed = True
+        self._event.set()
+
+    async def get(self):
+        while not self._pending:
+            if self._closed:
+                return None
+            self._event.clear()
+            await self._event.wait()
+        value = self._value
+        self._value = None
+        self._pending = False
+        return value
+
+    def take_skipped(self) -> int:
+        """Return and reset the number of items replaced before being read"""
+        skipped = self.skipped
+        self.skipped = 0
+        return skipped
+
+
+def log_skipped(latest: LatestValue) -> None:
+    """Report messages a source dropped in favour of newer ones"""
+    skipped = latest.take_skipped()
+    if skipped and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Skipping %d old messages, sending latest only", skipped)
+
+
+class TopicSubscriber:
+    """rclpy subscription that hands the latest message to the event loop"""
+
+    def __init__(self, node, topic_name: str, msg_type, loop: asyncio.AbstractEventLoop):
+        self.latest = LatestValue()
+        self._node = node
+        self._loop = loop
+        self._subscription = node.create_subscription(
+            msg_type, topic_name, self._on_message, qos_profile_sensor_data
+        )
+
+    def _on_message(self, msg) -> None:
+        # Called on the executor thread; hop over to the event loop and keep
+        # only the newest message, like the CLI reader does
+        self._loop.call_soon_threadsafe(self.latest.set, msg)
+
+    def close(self) -> None:
+        self._node.destroy_subscription(self._subscription)
+
+
+def resolve_topic_type(topic_name: str) -> Optional[str]:
+    """Look up the message type of a topic on the ROS2 graph"""
+    for name, types in _ros_node.get_topic_names_and_types():
+        if name == topic_name and types:
+            return types[0]
+    return None
+
+
+def to_builtin(value):
+    """
+    Convert a message_to_ordereddict() result into plain Python types.
+    
+    Fixed-size array fields come back as lists of numpy scalars (or as
+    ndarrays); neither orjson nor msgspec can encode those.
+    """
+    if isinstance(value, dict):
+        return {key: to_builtin(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_builtin(item) for item in value]
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    if isinstance(value, array.array):
+        return value.tolist()
+    if isinstance(value, (bytes, bytearray)):
+        # byte/uint8 fields; ros2 topic echo prints these as numbers too
+        return list(value)
+    return value
+
+
+async def rclpy_topic_messages(topic_name: str):
+    """Yield the latest message from a ROS2 topic as a dict, using rclpy"""
+    subscriber = None
+    try:
+        type_str = resolve_topic_type(topic_name)
+        if type_str is None:
+            raise Exception(f"Could not determine the type for topic {topic_name}. Is it being published?")
         
-        for i, part in enumerate(parts[:-1]):
-            if part not in current:
-                current[part] = {}
-            current = current[part]
+        subscriber = TopicSubscriber(_ros_node, topic_name, get_message(type_str), asyncio.get_running_loop())
+        print(f"Subscribed to {topic_name} [{type_str}] via rclpy")
         
-        current[parts[-1]] = value
+        while True:
+            msg = await subscriber.latest.get()
+            log_skipped(subscriber.latest)
+            yield {
+                "topic": topic_name,
+                "timestamp": time.time_ns(),
+                "data": to_builtin(message_to_ordereddict(msg))
+            }
+            
+            # Same update rate as the CLI reader
+            await asyncio.sleep(0.05)
     
-    return result
+    except Exception as e:
+        print(f"ERROR in rclpy_topic_messages: {e}")
+        yield {
+            "topic": topic_name,
+            "timestamp": time.time_ns(),
+            "error": str(e)
+        }
+    finally:
+        if subscriber is not None:
+            subscriber.close()
+            print(f"Unsubscribed from {topic_name}")
 
 
-async def ros2_topic_generator(topic_name: str):
-    """Generate Server-Sent Events stream from ROS2 topic using subprocess"""
+async def read_ros2_echo_output(stdout: asyncio.StreamReader, latest: LatestValue) -> bool:
+    """
+    Parse ros2 topic echo output until EOF.
+    
+    Each complete message (terminated by '---') replaces the previous one in
+    `latest` as JSON bytes; `latest` is closed once reading stops.
+    Returns True if reading stopped at EOF, False if it failed.
+    """
+    out = bytearray()
+    parser_state = {}
+    try:
+        while True:
+            try:
+                line = await stdout.readline()
+            except ValueError:
+                # Line exceeded the stream limit; the reader already discarded it
+                continue
+            if not line:
+                print("EOF reached on stdout")
+                return True
+            
+            # Drop oversized lines without parsing them
+            if len(line) > _MAX_LINE:
+                continue
+            
+            # Check for message separator before decoding
+            if line.strip() == _SEP_BYTES:
+                if out:
+                    latest.set(finish_ros2_json(out, parser_state))
+                
+                # Reset for next message
+                out.clear()
+                parser_state = {}
+            else:
+                # Decode but keep leading spaces for indentation detection
+                parse_ros2_generic_output(line.decode(errors='replace').rstrip(), out, parser_state)
+    except Exception as e:
+        print(f"Error in read loop: {e}")
+        return False
+    finally:
+        latest.close()
+
+
+async def ros2_cli_topic_messages(topic_name: str):
+    """Yield the latest message from a ROS2 topic as a dict, using subprocess"""
     process = None
     try:
         print(f"Starting ROS2 topic echo for {topic_name}...")
         
-        # Prepare environment - source the correct ROS2 distro
-        env = os.environ.copy()
-        
-        # Force use of ROS2 humble if on Linux and rolling is detected
-        if sys.platform == 'linux' and env.get('ROS_DISTRO') == 'rolling':
-            print(f"Detected ROS_DISTRO=rolling, switching to humble...")
-            
-            # Clear ROS-related environment variables to avoid conflicts
-            ros_vars_to_clear = [k for k in env.keys() if k.startswith('ROS_') or k.startswith('AMENT_') or 'ros' in k.lower()]
-            for var in ros_vars_to_clear:
-                if var in ['ROSLISP_PACKAGE_DIRECTORIES', 'ROS_DISTRO', 'ROS_VERSION', 'ROS_PYTHON_VERSION']:
-                    del env[var]
-            
-            # Source humble and run ros2 topic echo with --no-daemon to avoid daemon conflicts
-            cmd = f'source /opt/ros/humble/setup.bash && ros2 topic echo {topic_name} --no-daemon'
-            print(f"Running command: {cmd}")
-        else:
-            # Use --no-daemon flag to bypass daemon (avoids compatibility issues)
-            cmd = f'ros2 topic echo {topic_name} --no-daemon'
-            print(f"Running command: {cmd}")
-        
-        print(f"Original ROS_DISTRO: {os.environ.get('ROS_DISTRO', 'Not set')}")
-        
-        # Use shell mode on both Windows and Linux to properly handle environment
-        # On Linux, we need to use bash explicitly to handle 'source' command
-        if sys.platform == 'linux':
-            process = await asyncio.create_subprocess_shell(
-                cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                env=env,
-                executable='/bin/bash'
-            )
-        else:
-            process = await asyncio.create_subprocess_shell(
-                cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                env=env
-            )
+        # Use --no-daemon flag to bypass daemon (avoids compatibility issues)
+        process = await asyncio.create_subprocess_exec(
+            'ros2', 'topic', 'echo', topic_name, '--no-daemon',
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=_ros2_env,
+            limit=_STDOUT_LIMIT
+        )
         
         print(f"Subprocess started successfully. PID: {process.pid}")
         
@@ -204,103 +524,66 @@ async def ros2_topic_generator(topic_name: str):
             print(f"STDERR: {error_msg}")
             raise Exception(f"ROS2 command failed: {error_msg}")
         
-        data_buffer = {}
-        parser_state = {}
-        line_count = 0
-        last_complete_data = None
-        messages_pending = []
+        # The reader parses stdout as fast as it arrives; we only ever see
+        # the newest complete message
+        latest = LatestValue()
+        reader = asyncio.create_task(read_ros2_echo_output(process.stdout, latest))
         
-        # Read output line by line
-        while True:
-            # Check if process is still running
-            if process.returncode is not None:
-                print(f"Process terminated with return code: {process.returncode}")
-                # Read any remaining stderr
-                try:
-                    stderr_output = await asyncio.wait_for(process.stderr.read(), timeout=0.5)
-                    if stderr_output:
-                        print(f"STDERR: {stderr_output.decode()}")
-                except asyncio.TimeoutError:
-                    pass
-                break
-            
-            try:
-                # Read all available lines to avoid lag - don't wait if no data
-                lines_read = 0
-                while True:
-                    try:
-                        line = await asyncio.wait_for(process.stdout.readline(), timeout=0.01)
-                        if line:
-                            # Decode but keep leading spaces for indentation detection
-                            line = line.decode().rstrip()  # Only strip trailing whitespace
-                            line_count += 1
-                            lines_read += 1
-                            
-                            # Check for message separator (after stripping for comparison)
-                            if line.strip() == '---':
-                                # If we have complete data, add it to pending messages
-                                if data_buffer:
-                                    # Convert flat dict to nested structure
-                                    nested_data = flatten_to_nested_dict(data_buffer)
-                                    messages_pending.append(nested_data)
-                                    print(f"Message buffered (total pending: {len(messages_pending)}): {list(nested_data.keys())}")
-                                
-                                # Reset for next message
-                                data_buffer = {}
-                                parser_state = {}
-                            else:
-                                # Parse the output line using generic parser (preserve leading spaces)
-                                parse_ros2_generic_output(line, data_buffer, parser_state)
-                        else:
-                            # EOF reached
-                            print("EOF reached on stdout")
-                            break
-                    except asyncio.TimeoutError:
-                        # No more data available right now
-                        break
+        try:
+            while True:
+                latest_data = await latest.get()
+                if latest_data is None:
+                    # Reader stopped (EOF or error)
+                    break
+                log_skipped(latest)
+                
+                # The parser already produced the JSON for "data"
+                data = {
+                    "topic": topic_name,
+                    "timestamp": time.time_ns(),
+                    "data": latest_data
+                }
                 
-                # After reading all available data, send only the MOST RECENT message
-                if messages_pending:
-                    # Get the most recent message (last in list)
-                    latest_data = messages_pending[-1]
-                    skipped = len(messages_pending) - 1
-                    
-                    if skipped > 0:
-                        print(f"Skipping {skipped} old messages, sending latest only")
-                    
-                    timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-                    
-                    # Format data for SSE - use the nested structure directly
-                    data = {
-                        "topic": topic_name,
-                        "timestamp": timestamp,
-                        "data": latest_data
-                    }
-                    
-                    # Yield formatted SSE data
-                    print(f"Sending latest data: {str(latest_data)[:100]}...")
-                    yield f"data: {json.dumps(data)}\n\n"
-                    
-                    # Clear pending messages
-                    messages_pending = []
+                # Yield the payload; framing is left to the caller
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Sending latest data: %s...", latest_data[:100].decode(errors='replace'))
+                yield data
                 
-                # Small delay before next read cycle
+                # Small delay before next send; messages arriving meanwhile replace each other
                 await asyncio.sleep(0.05)
-                
-            except Exception as loop_error:
-                print(f"Error in read loop: {loop_error}")
-                await asyncio.sleep(0.1)
+        finally:
+            reader.cancel()
+        
+        # The reader closed `latest` and returned, so its result is ready. If it
+        # failed rather than hit EOF, ros2 is still running with nobody reading it
+        if not reader.result():
+            print(f"Stopping ROS2 topic echo for {topic_name} after read error")
+            process.terminate()
+        
+        try:
+            returncode = await asyncio.wait_for(process.wait(), timeout=2.0)
+        except asyncio.TimeoutError:
+            process.kill()
+            returncode = await process.wait()
+        print(f"Process terminated with return code: {returncode}")
+        # Read any remaining stderr
+        try:
+            stderr_output = await asyncio.wait_for(process.stderr.read(), timeout=0.5)
+            if stderr_output:
+                print(f"STDERR: {stderr_output.decode()}")
+        except asyncio.TimeoutError:
+            pass
             
     except Exception as e:
-        print(f"ERROR in ros2_topic_generator: {e}")
+        print(f"ERROR in ros2_cli_topic_messages: {e}")
         import traceback
         traceback.print_exc()
         error_data = {
             "topic": topic_name,
-            "timestamp": datetime.now().strftime("%H:%M:%S.%f")[:-3],
+            "timestamp": time.time_ns(),
             "error": str(e)
         }
-        yield f"data: {json.dumps(error_data)}\n\n"
+        yield error_data
     finally:
         if process and process.returncode is None:
             print(f"Terminating subprocess for {topic_name}")
@@ -309,6 +592,168 @@ async def ros2_topic_generator(topic_name: str):
             print(f"Subprocess terminated")
 
 
+class StreamMessage:
+    """A message shared by all clients of a topic, encoded at most once per wire format"""
+
+    __slots__ = ('data', '_sse', '_msgpack')
+
+    def __init__(self, data: Dict):
+        self.data = data
+        self._sse = None
+        self._msgpack = None
+
+    def _error_data(self, e: Exception) -> Dict:
+        # Same shape as the sources' error messages, so the page can show it
+        print(f"Failed to encode message for {self.data.get('topic')}: {e}")
+        return {
+            "topic": self.data.get("topic"),
+            "timestamp": self.data.get("timestamp", time.time_ns()),
+            "error": f"Failed to encode message: {e}"
+        }
+
+    @property
+    def sse(self) -> bytes:
+        """Server-Sent Events frame (HH:MM:SS.mmm timestamp)"""
+        if self._sse is None:
+            try:
+                self._sse = self._encode_sse(self.data)
+            except Exception as e:
+                # Cached, so every client gets the error frame instead of a dropped stream
+                self._sse = self._encode_sse(self._error_data(e))
+        return self._sse
+
+    @property
+    def msgpack(self) -> bytes:
+        """Length-prefixed MessagePack frame (integer ns timestamp)"""
+        if self._msgpack is None:
+            try:
+                self._msgpack = self._encode_msgpack(self.data)
+            except Exception as e:
+                self._msgpack = self._encode_msgpack(self._error_data(e))
+        return self._msgpack
+
+    @staticmethod
+    def _encode_sse(data: Dict) -> bytes:
+        timestamp = _fast_ts(data["timestamp"])
+        body = data.get("data")
+        if isinstance(body, bytes):
+            # Already JSON from the ros2 echo parser; splice it in as-is
+            return (
+                b'data: {"topic":' + _DUMPS(data["topic"])
+                + b',"timestamp":' + _DUMPS(timestamp)
+                + b',"data":' + body + b'}\n\n'
+            )
+        return b"data: " + _DUMPS({**data, "timestamp": timestamp}) + b"\n\n"
+
+    @staticmethod
+    def _encode_msgpack(data: Dict) -> bytes:
+        if isinstance(data.get("data"), bytes):
+            data = {**data, "data": orjson.loads(data["data"])}
+        payload = _ENC.encode(data)
+        return len(payload).to_bytes(4, 'big') + payload
+
+
+class TopicHub:
+    """
+    A single ROS2 source for one topic, fanned out to every connected client.
+    
+    Each subscriber gets a LatestValue, so a slow client only ever skips to
+    the newest message. The source is stopped shortly after the last
+    subscriber leaves, so a quick page reload can reuse it.
+    """
+
+    def __init__(self, topic_name: str):
+        self.topic_name = topic_name
+        self.done = False
+        self._subscribers: Set[LatestValue] = set()
+        self._linger = None
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        source = rclpy_topic_messages if _ros_node is not None else ros2_cli_topic_messages
+        try:
+            async with aclosing(source(self.topic_name)) as messages:
+                async for data in messages:
+                    message = StreamMessage(data)
+                    for latest in self._subscribers:
+                        latest.set(message)
+        finally:
+            self.done = True
+            if _topic_hubs.get(self.topic_name) is self:
+                del _topic_hubs[self.topic_name]
+            # Subscribers finish once they have read the last message
+            for latest in self._subscribers:
+                latest.close()
+
+    def subscribe(self) -> LatestValue:
+        if self._linger is not None:
+            self._linger.cancel()
+            self._linger = None
+        latest = LatestValue()
+        self._subscribers.add(latest)
+        return latest
+
+    def unsubscribe(self, latest: LatestValue) -> None:
+        self._subscribers.discard(latest)
+        if not self._subscribers and not self.done:
+            self._linger = asyncio.get_running_loop().call_later(_HUB_LINGER, self.close)
+
+    def close(self) -> asyncio.Task:
+        # Unregister now so a client arriving mid-shutdown starts a fresh hub
+        if _topic_hubs.get(self.topic_name) is self:
+            del _topic_hubs[self.topic_name]
+        self._task.cancel()
+        return self._task
+
+
+# One hub per topic currently being streamed
+_topic_hubs: Dict[str, TopicHub] = {}
+# Seconds a hub outlives its last subscriber
+_HUB_LINGER = 5.0
+
+
+async def stop_topic_hubs() -> None:
+    """Stop every topic source, e.g. before the rclpy node goes away"""
+    tasks = [hub.close() for hub in list(_topic_hubs.values())]
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def ros2_topic_messages(topic_name: str):
+    """
+    Yield the latest StreamMessage from a ROS2 topic, in-process when rclpy is available.
+    
+    All clients of a topic share one source through its TopicHub.
+    The "timestamp" field is an integer time.time_ns() and "data" is a dict, or
+    already-encoded JSON bytes from the ros2 CLI; each wire format renders them.
+    """
+    hub = _topic_hubs.get(topic_name)
+    if hub is None:
+        hub = _topic_hubs[topic_name] = TopicHub(topic_name)
+    
+    latest = hub.subscribe()
+    try:
+        while True:
+            message = await latest.get()
+            if message is None:
+                break
+            yield message
+    finally:
+        hub.unsubscribe(latest)
+
+
+async def ros2_topic_generator(topic_name: str):
+    """Generate Server-Sent Events stream from ROS2 topic"""
+    async with aclosing(ros2_topic_messages(topic_name)) as messages:
+        async for message in messages:
+            yield message.sse
+
+
+async def ros2_topic_msgpack_generator(topic_name: str):
+    """Generate length-prefixed MessagePack frames from ROS2 topic (integer ns timestamps)"""
+    async with aclosing(ros2_topic_messages(topic_name)) as messages:
+        async for message in messages:
+            yield message.msgpack
+
 
 async def event_generator(topic_name: str):
     """Generate Server-Sent Events stream for a specific topic"""
@@ -317,7 +762,7 @@ async def event_generator(topic_name: str):
         data = generate_random_coordinates(topic_name)
         
         # Format as SSE
-        yield f"data: {json.dumps(data)}\n\n"
+        yield b"data: " + _DUMPS(data) + b"\n\n"
         
         # Send updates every 500ms
         await asyncio.sleep(0.5)
@@ -329,39 +774,46 @@ async def root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 
-@app.get("/topics")
-async def get_topics():
-    """Return list of available topics from ROS2"""
+def rclpy_list_topics() -> Dict:
+    """List topics with their types from the in-process rclpy node"""
     try:
-        print("Fetching ROS2 topics...")
+        topics = [
+            {"name": name, "type": types[0] if types else "unknown"}
+            for name, types in _ros_node.get_topic_names_and_types()
+        ]
         
-        # Prepare environment
-        env = os.environ.copy()
+        if not topics:
+            return {
+                "error": "No topics",
+                "message": "No topics found. Make sure ROS2 nodes are running.",
+                "topics": []
+            }
         
-        # Build command
-        if sys.platform == 'linux' and env.get('ROS_DISTRO') == 'rolling':
-            cmd = 'source /opt/ros/humble/setup.bash && ros2 topic list --no-daemon'
-        else:
-            cmd = 'ros2 topic list --no-daemon'
+        print(f"Found {len(topics)} topics via rclpy")
+        return {"topics": topics}
         
-        print(f"Running: {cmd}")
+    except Exception as e:
+        print(f"Exception while fetching topics: {e}")
+        import traceback
+        traceback.print_exc()
+        return {
+            "error": "Exception",
+            "message": str(e)
+        }
+
+
+async def ros2_cli_list_topics() -> Dict:
+    """List topics by running ros2 topic list in a subprocess"""
+    try:
+        print("Fetching ROS2 topics...")
         
         # Run ros2 topic list command
-        if sys.platform == 'linux':
-            process = await asyncio.create_subprocess_shell(
-                cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                env=env,
-                executable='/bin/bash'
-            )
-        else:
-            process = await asyncio.create_subprocess_shell(
-                cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                env=env
-            )
+        process = await asyncio.create_subprocess_exec(
+            'ros2', 'topic', 'list', '--no-daemon',
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            env=_ros2_env
+        )
         
         # Wait for command to complete with timeout
         try:
@@ -414,6 +866,33 @@ async def get_topics():
         }
 
 
+# /topics results are cached briefly so concurrent page loads share one lookup
+_TOPICS_TTL = 2.0
+_topics_cache = {"ts": 0.0, "val": None}
+_topics_lock = asyncio.Lock()
+
+
+@app.get("/topics")
+async def get_topics():
+    """Return list of available topics from ROS2"""
+    if time.monotonic() - _topics_cache["ts"] < _TOPICS_TTL:
+        return _topics_cache["val"]
+    
+    async with _topics_lock:
+        # Another request may have refreshed the cache while we waited
+        if time.monotonic() - _topics_cache["ts"] < _TOPICS_TTL:
+            return _topics_cache["val"]
+        
+        if _ros_node is not None:
+            result = rclpy_list_topics()
+        else:
+            result = await ros2_cli_list_topics()
+        
+        _topics_cache["val"] = result
+        _topics_cache["ts"] = time.monotonic()
+        return result
+
+
 @app.get("/stream/{topic_name:path}")
 async def stream_topic(topic_name: str):
     """Stream data from a specific topic using Server-Sent Events"""
@@ -431,6 +910,23 @@ async def stream_topic(topic_name: str):
     )
 
 
+@app.get("/stream_mp/{topic_name:path}")
+async def stream_topic_msgpack(topic_name: str):
+    """Stream data from a specific topic as length-prefixed MessagePack frames"""
+    generator = ros2_topic_msgpack_generator(topic_name)
+    
+    return StreamingResponse(
+        generator,
+        media_type="application/vnd.msgpack-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # uvloop (installed with uvicorn[standard]) is not available on Windows
+    loop = "asyncio" if sys.platform == 'win32' else "uvloop"
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop=loop, http="httptools")